@@ -6,10 +6,17 @@ to Microsoft Teams as a single Adaptive Card.
 """
 
 import os
-import json
+import time
+import itertools
+import orjson
 import requests
-import feedparser
+import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import boto3
+from botocore.config import Config
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 
 # --- Environment Variables ---
@@ -17,8 +24,16 @@ from datetime import datetime, timedelta, timezone
 
 # AWS Services Configuration
 TEAMS_WEBHOOK_URL = os.environ.get('TEAMS_WEBHOOK_URL')
+# Opt-in: sends a HEAD to the webhook each run, which some endpoints (e.g. Workflows) record
+TEAMS_PREWARM_ENABLED = os.environ.get('TEAMS_PREWARM_ENABLED', 'false').lower() == 'true'
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID')
+BEDROCK_MAX_TOKENS = 2048 # Output is at most 3 papers (~400 Japanese tokens each)
+BEDROCK_REASONING_EXTRA_TOKENS = 4096 # Extra budget for reasoning models' thinking output
+BEDROCK_REASONING_MODEL_MARKERS = ('gpt-oss', 'deepseek')
+# Opt-in: only enable for models that support Bedrock prompt caching
+# (cache points on other models fail the whole request with a ValidationException)
+BEDROCK_PROMPT_CACHE_ENABLED = os.environ.get('BEDROCK_PROMPT_CACHE_ENABLED', 'false').lower() == 'true'
 
 # RSS Feeds (comma-separated URLs)
 RSS_FEED_URLS_ENV = os.environ.get('RSS_FEED_URLS', '') 
@@ -26,6 +41,11 @@ RSS_FEED_URLS_ENV = os.environ.get('RSS_FEED_URLS', '')
 # Processing Configuration
 MAX_ARTICLES_TO_PROCESS_ENV = os.environ.get('MAX_ARTICLES_TO_PROCESS', '20')
 ABSTRACT_TRUNCATE_LENGTH = 1500 # Max length for abstracts to save tokens
+FEED_FETCH_MAX_WORKERS_ENV = os.environ.get('FEED_FETCH_MAX_WORKERS', '8') # Caps concurrent feed fetches
+DYNAMODB_BATCH_GET_LIMIT = 100 # Max keys per BatchGetItem request
+DYNAMODB_BATCH_GET_MAX_ATTEMPTS = 5 # Max BatchGetItem rounds per chunk (UnprocessedKeys retries)
+ARTICLE_TTL_SECONDS = 7 * 24 * 60 * 60 # Processed URLs expire from DynamoDB after 7 days
+SEEN_URL_CACHE_MAX = 4096 # Max processed URLs remembered across warm invocations
 
 # Hierarchical Topic Environments (L0-L6)
 TOPICS_L0_DOMAIN_ENV = os.environ.get('TOPICS_L0_DOMAIN', '')
@@ -36,18 +56,198 @@ TOPICS_L4_APPLICATION_ENV = os.environ.get('TOPICS_L4_APPLICATION', '')
 TOPICS_L5_ENVIRONMENT_ENV = os.environ.get('TOPICS_L5_ENVIRONMENT', '')
 TOPICS_L6_CHALLENGE_ENV = os.environ.get('TOPICS_L6_CHALLENGE', '')
 
+# L0-L6 topic hierarchy, parsed once during container initialization
+def parse_topics(env_var):
+    return [t.strip() for t in env_var.split(',') if t.strip()]
+
+TOPIC_HIERARCHY = {
+    "L0_Domain": parse_topics(TOPICS_L0_DOMAIN_ENV),
+    "L1_Approach": parse_topics(TOPICS_L1_APPROACH_ENV),
+    "L2_Task": parse_topics(TOPICS_L2_TASK_ENV),
+    "L3_Modality": parse_topics(TOPICS_L3_MODALITY_ENV),
+    "L4_Application": parse_topics(TOPICS_L4_APPLICATION_ENV),
+    "L5_Environment": parse_topics(TOPICS_L5_ENVIRONMENT_ENV),
+    "L6_Challenge": parse_topics(TOPICS_L6_CHALLENGE_ENV)
+}
+
 # --- AWS Service Clients (Global) ---
-# Initialize clients outside the handler for container reuse
+# Initialize clients outside the handler for container reuse.
+# TCP keepalive prevents stale pooled sockets on long-lived warm containers;
+# adaptive retries back off client-side on Bedrock throttling.
+AWS_CONNECT_TIMEOUT = 3 # Seconds
+AWS_READ_TIMEOUT = 30 # Socket read timeout in seconds (max idle gap between reads) for both clients
+AWS_MAX_ATTEMPTS = 3
+# Remaining invocation time at which the Bedrock stream is abandoned: one idle read
+# gap (the deadline is only checked between stream events) plus time to finish the handler
+BEDROCK_DEADLINE_MARGIN_SECONDS = AWS_READ_TIMEOUT + 10
+aws_client_config = Config(
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": AWS_MAX_ATTEMPTS},
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    max_pool_connections=16
+)
 try:
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = boto3.resource('dynamodb', config=aws_client_config)
     dynamodb_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-    bedrock_runtime = boto3.client(service_name='bedrock-runtime', region_name='us-east-1') 
+    bedrock_runtime = boto3.client(service_name='bedrock-runtime', region_name='us-east-1', config=aws_client_config) 
 except Exception as e:
     print(f"[ERROR] Failed to initialize AWS clients: {e}")
     dynamodb = None
     dynamodb_table = None
     bedrock_runtime = None
 
+# --- Processed URL Cache (Global) ---
+# LRU set of URLs known to be processed; survives across warm invocations
+seen_url_cache = OrderedDict()
+
+# --- HTTP Session (Global) ---
+# Reuse TCP/TLS connections to the RSS feeds and Teams webhook across warm invocations
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16, # Feeds share one host and are fetched concurrently
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504] # Idempotent methods only (urllib3 default)
+    )
+))
+if TEAMS_WEBHOOK_URL:
+    # The webhook POST is not idempotent: a 5xx or read timeout may follow an accepted
+    # post, so only retry rejected requests (429) and connection failures
+    http_session.mount(TEAMS_WEBHOOK_URL, HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=1,
+        max_retries=Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.2,
+            status_forcelist=[429],
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True
+        )
+    ))
+
+# --- Feed XML Namespaces ---
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+
+# --- Bedrock Tool Definition ---
+# Structured output schema enforced via Converse API tool use
+SELECT_PAPERS_TOOL_SPEC = {
+    "name": "select_papers",
+    "description": "Report the papers selected from the paper list (at most 3).",
+    "inputSchema": {
+        "json": {
+            "type": "object",
+            "properties": {
+                "selected_papers": {
+                    "type": "array",
+                    "maxItems": 3,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "url": {"type": "string"},
+                            "title": {"type": "string"},
+                            "matched_topic": {
+                                "anyOf": [
+                                    {"type": "string"},
+                                    {"type": "array", "items": {"type": "string"}}
+                                ]
+                            },
+                            "summary": {"type": "string"},
+                            "keywords": {"type": "array", "items": {"type": "string"}}
+                        },
+                        "required": ["url", "title", "matched_topic", "summary", "keywords"]
+                    }
+                }
+            },
+            "required": ["selected_papers"]
+        }
+    }
+}
+
+# --- Bedrock Prompt (Global) ---
+# The topic hierarchy and evaluation rubric are static, so build them once and
+# send them as a cacheable system prompt; only the paper list varies per invocation
+# (orjson always emits UTF-8, equivalent to ensure_ascii=False, and returns bytes)
+TOPIC_HIERARCHY_JSON = orjson.dumps(TOPIC_HIERARCHY, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+PROMPT_TOPIC_SECTION = f"""
+    あなたは、複数の技術分野に精通した高度な学術専門家です。
+    あなたの任務は、提示された「論文リスト」を、定義された「トピック階層」に基づいて厳密に分析・評価し、最も価値のある論文を選定することです。
+
+    ## トピック階層 (評価基準)
+    {TOPIC_HIERARCHY_JSON}
+
+    * L0_Domain: 学術ドメイン（研究分野）
+    * L1_Approach: 技術アプローチ（手法）
+    * L2_Task: タスク（目的・課題）
+    * L3_Modality: データモダリティ（入力情報）
+    * L4_Application: 応用分野（ユースケース）
+    * L5_Environment: 実装環境・制約条件
+    * L6_Challenge: 学習上の課題（研究テーマ的視点）
+    """
+
+PROMPT_INSTRUCTION_SECTION = """
+    ## 指示 (厳守)
+    「論文リスト」の全論文を評価し、以下の「評価基準」に基づいて、最も価値が高いと判断される論文を**最大3件**まで選定してください。
+
+    ### 評価基準 (優先度順)
+
+    1.  **最高評価 (High Priority: 課題解決・応用融合)**
+        * 複数のレイヤーにまたがる、価値の高い貢献をしている論文。
+        * **(パターンA: 課題解決型)** L6（課題）に対し、新しいL1（手法）やL2（タスク）を提案し、解決策を示している。
+        * **(パターンB: 応用融合型)** L1（手法）やL2（タスク）を、L4（応用分野）やL5（実装環境）に適用し、実用的な成果や新しい知見を提供している。
+
+    2.  **中評価 (Medium Priority: 中核技術の革新)**
+        * L1（手法）またはL2（タスク）自体に、従来技術を大幅に超えるような画期的な（State-of-the-Art）提案、または新しい概念を提示している。
+
+    3.  **選定対象外 (Low Priority)**
+        * L0（ドメイン）の総説（Survey）論文。
+        * L3（モダリティ）のデータセット紹介のみ。
+        * L4（応用分野）のみに関連する、技術的新規性の低い事例報告。
+
+    ### 選定プロセス
+    * 「論文リスト」全体から、「最高評価」（パターンA, B）に合致する論文のみを選定対象とします。
+    * 「中評価」および「選定対象外」の基準に合致する論文は、選定しないでください。
+    * 「最高評価」に合致した論文の中から、重要度が高い順に最大3件を選定してください。
+
+    ### 出力形式 (JSON)
+    選定した論文についてのみ、以下の情報を `select_papers` ツールの入力として出力してください。
+
+    1.  `url`: 論文のURL (論文リストからそのままコピー)
+    2.  `title`: 論文のタイトル (論文リストからそのままコピー)
+    3.  `matched_topic`: **最も主要な貢献**と判断したトピック名（L1, L2, L4, L6などから）。**複数該当する場合は文字列のリスト**とすること。
+    4.  `summary`: アブストラクトの核心的な内容を、日本語で200文字程度に簡潔に要約してください。
+    5.  `keywords`: 論文の主要な日本語キーワードを**3件**程度のリスト。
+
+    例 (1件選定された場合):
+    {
+      "selected_papers": [
+        {
+          "url": "http://arxiv.org/abs/...",
+          "title": "農業用少数ショット学習",
+          "matched_topic": ["少数ショット", "農業ロボット工学"],
+          "summary": "少数ショット(L6)という課題に対し、新しい対照学習(L1)を提案。農業分野(L4)での作物分類(L2)タスクで有効性を実証。",
+          "keywords": ["少数ショット", "対照学習", "農業ロボット工学"]
+        }
+      ]
+    }
+    
+    例 (該当なしの場合):
+    {
+      "selected_papers": []
+    }
+    """
+
+SYSTEM_PROMPT = PROMPT_TOPIC_SECTION + PROMPT_INSTRUCTION_SECTION
+PAPER_LIST_HEADER = "## 論文リスト (分析対象)\n"
+
+# --- Teams Card Template ---
+# Topic, keywords and summary of a paper; \n\n creates a new paragraph (visual gap) in Markdown
+PAPER_MARKDOWN_TEMPLATE = "**該当トピック:**\n{topic}\n\n**キーワード:**\n{keywords}\n\n{summary}"
+
 JST = timezone(timedelta(hours=+9), 'JST')
 
 def lambda_handler(event, context):
@@ -87,34 +287,16 @@ def lambda_handler(event, context):
         print(f"[ERROR] Failed to parse RSS_FEED_URLS: {e}")
         return {'statusCode': 500, 'body': 'Failed to parse RSS_FEED_URLS'}
 
-    # Parse L0-L6 Hierarchical Topics
-    try:
-        def parse_topics(env_var):
-            return [t.strip() for t in env_var.split(',') if t.strip()]
-
-        topic_hierarchy = {
-            "L0_Domain": parse_topics(TOPICS_L0_DOMAIN_ENV),
-            "L1_Approach": parse_topics(TOPICS_L1_APPROACH_ENV),
-            "L2_Task": parse_topics(TOPICS_L2_TASK_ENV),
-            "L3_Modality": parse_topics(TOPICS_L3_MODALITY_ENV),
-            "L4_Application": parse_topics(TOPICS_L4_APPLICATION_ENV),
-            "L5_Environment": parse_topics(TOPICS_L5_ENVIRONMENT_ENV),
-            "L6_Challenge": parse_topics(TOPICS_L6_CHALLENGE_ENV)
-        }
-        
-        if not any(topic_hierarchy.values()):
-             print("All topic environment variables (TOPICS_L0_... etc.) are empty. Exiting.")
-             return {'statusCode': 200, 'body': 'All topic environments are empty.'}
-        
-        print("Successfully loaded L0-L6 hierarchical topics.")
-        
-    except Exception as e:
-        print(f"[ERROR] Failed to parse Topic Hierarchy environments: {e}")
-        return {'statusCode': 500, 'body': 'Failed to parse Topic Hierarchy'}
+    # Check L0-L6 Hierarchical Topics
+    if not any(TOPIC_HIERARCHY.values()):
+        print("All topic environment variables (TOPICS_L0_... etc.) are empty. Exiting.")
+        return {'statusCode': 200, 'body': 'All topic environments are empty.'}
+
+    print("Successfully loaded L0-L6 hierarchical topics.")
 
     # 2. Collect Unprocessed Papers
     papers_to_analyze, processed_urls_in_this_run = collect_unprocessed_papers(
-        feed_urls_list, limit_per_feed
+        feed_urls_list, limit_per_feed, max_to_process
     )
 
     if not papers_to_analyze:
@@ -124,13 +306,22 @@ def lambda_handler(event, context):
     print(f"Collected {len(papers_to_analyze)} unprocessed articles total. Sending to LLM for analysis.")
 
     # 3. Analyze Papers via Bedrock
-    selected_papers = []
-    try:
-        analysis_result = analyze_papers_with_bedrock(papers_to_analyze, topic_hierarchy)
+    # The DynamoDB write does not depend on the Bedrock output, so mark all analyzed
+    # papers as processed (avoiding reprocessing on Bedrock errors) and optionally warm
+    # up the Teams connection in the background while Bedrock streams its output.
+    # NOTE: the write starts before Bedrock finishes, so if the Bedrock call is abandoned
+    # at the deadline or the Lambda crashes mid-stream, these papers stay marked as
+    # processed and are never analyzed. The deadline check in analyze_papers_with_bedrock
+    # only keeps the handler from being killed; it does not bring those papers back.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        print(f"Marking {len(processed_urls_in_this_run)} articles as processed in DynamoDB.")
+        executor.submit(mark_articles_as_processed, processed_urls_in_this_run)
+        if TEAMS_PREWARM_ENABLED:
+            executor.submit(prewarm_teams_connection)
+
+        analysis_result = analyze_papers_with_bedrock(papers_to_analyze, context)
         selected_papers = analysis_result.get("selected_papers", [])
-    except Exception as e:
-        print(f"[ERROR] An error occurred during Bedrock call: {e}")
-        # Continue to DB update to avoid reprocessing errors
+    # Leaving the executor waits for the background DynamoDB write and prewarm
 
     # 4. Post Summary to Teams
     if selected_papers:
@@ -144,60 +335,90 @@ def lambda_handler(event, context):
     else:
         print("LLM did not select any relevant articles from the batch.")
 
-    # 5. Mark All Analyzed Papers as Processed
-    print(f"Marking {len(processed_urls_in_this_run)} articles as processed in DynamoDB.")
-    for url in processed_urls_in_this_run:
-        mark_article_as_processed(url)
-
     print("Process complete.")
     return {'statusCode': 200, 'body': f'Process successful. Analyzed {len(papers_to_analyze)} articles.'}
 
 # --- Helper Functions ---
 
-def collect_unprocessed_papers(feed_urls, limit_per_feed):
+def collect_unprocessed_papers(feed_urls, limit_per_feed, max_to_process):
     """
-    Iterates over RSS feeds, collects unprocessed papers up to the limit.
+    Iterates over RSS feeds, collects unprocessed papers up to the per-feed
+    limit and the overall max_to_process budget.
     """
     papers_to_analyze = []
     processed_urls = []
 
-    for feed_url in feed_urls:
-        print(f"Processing feed: {feed_url}")
-        
-        try:
-            feed = feedparser.parse(feed_url)
-            if feed.bozo:
-                print(f"[WARN] Failed to parse feed: {feed_url}, Exception: {feed.bozo_exception}")
+    # Parse feed processing concurrency (bounded to stay within Lambda's socket budget)
+    try:
+        max_workers = int(FEED_FETCH_MAX_WORKERS_ENV)
+    except ValueError:
+        max_workers = 8
+    max_workers = max(1, min(max_workers, len(feed_urls)))
+
+    # Phase 1: Fetch and parse all feeds concurrently (network-bound)
+    entries_by_feed = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_feed_entries, feed_url): feed_url for feed_url in feed_urls}
+
+        # Consume parsed feeds on the main thread as they complete (no lock needed)
+        for future in as_completed(futures):
+            feed_url = futures[future]
+            print(f"Processing feed: {feed_url}")
+
+            try:
+                entries = future.result()
+            except Exception as e:
+                print(f"[WARN] Failed to fetch or parse feed: {e} (URL: {feed_url})")
                 continue
-        except Exception as e:
-            print(f"[WARN] feedparser library error: {e} (URL: {feed_url})")
-            continue
 
-        if not feed.entries:
-            print(f"Feed has no entries: {feed_url}")
-            continue
+            if not entries:
+                print(f"Feed has no entries: {feed_url}")
+                continue
+
+            entries_by_feed[feed_url] = entries
+
+    # Restore the configured RSS_FEED_URLS order so the budget cut-off below
+    # does not depend on network timing
+    feed_entries = [
+        (feed_url, entries_by_feed[feed_url])
+        for feed_url in dict.fromkeys(feed_urls) if feed_url in entries_by_feed
+    ]
+
+    # Phase 2: Look up all candidate URLs in DynamoDB with batched reads
+    candidate_urls = [entry['link'] for _, entries in feed_entries for entry in entries]
+    processed_set = get_processed_article_urls(candidate_urls)
+
+    # Phase 3: Pick up to limit_per_feed unprocessed papers from each feed
+    seen_this_run = set() # Cross-listed papers appear in multiple feeds
+    for feed_url, entries in feed_entries:
+        # Stop consuming entries once the overall budget is filled
+        if len(papers_to_analyze) >= max_to_process:
+            print(f"Reached the maximum of {max_to_process} articles. Skipping remaining feeds.")
+            break
 
         fetched_from_this_feed = 0
         
-        for entry in feed.entries:
+        for entry in entries:
             if fetched_from_this_feed >= limit_per_feed:
                 break 
 
-            article_url = entry.link 
+            article_url = entry['link']
 
-            if is_article_processed(article_url):
+            if article_url in processed_set or article_url in seen_this_run:
                 continue
+            seen_this_run.add(article_url)
 
             # --- Found unprocessed paper ---
             fetched_from_this_feed += 1
             processed_urls.append(article_url)
             
-            article_title = entry.title
-            abstract = entry.summary
+            article_title = entry['title']
+            abstract = entry['summary']
             
-            truncated_abstract = abstract[:ABSTRACT_TRUNCATE_LENGTH]
-            if len(abstract) > ABSTRACT_TRUNCATE_LENGTH:
-                truncated_abstract += "... (truncated)"
+            # Slice one extra character to detect overflow without measuring the full string
+            truncated_abstract = abstract[:ABSTRACT_TRUNCATE_LENGTH + 1]
+            if len(truncated_abstract) > ABSTRACT_TRUNCATE_LENGTH:
+                truncated_abstract = truncated_abstract[:ABSTRACT_TRUNCATE_LENGTH] + "... (truncated)"
                 
             papers_to_analyze.append({
                 "url": article_url,
@@ -207,163 +428,315 @@ def collect_unprocessed_papers(feed_urls, limit_per_feed):
             
     return papers_to_analyze, processed_urls
 
-def is_article_processed(url):
+def fetch_feed_entries(feed_url):
     """
-    Checks DynamoDB to see if the article URL has already been processed.
+    Fetches a feed and returns its entries as dicts with link, title and summary.
+    arXiv feeds are well-formed, so they are parsed with ElementTree directly;
+    feedparser is only used as a fallback for anything ElementTree cannot handle.
     """
+    response = http_session.get(feed_url, timeout=10)
+    response.raise_for_status()
+
     try:
-        response = dynamodb_table.get_item(Key={'article_url': url})
-        return 'Item' in response
-    except Exception as e:
-        print(f"[ERROR] DynamoDB get_item error: {e}")
-        return False # Fail safe: treat as unprocessed
+        entries = parse_feed_entries(response.content)
+    except ET.ParseError as e:
+        print(f"[WARN] XML parse error, falling back to feedparser: {e} (URL: {feed_url})")
+        entries = None
+
+    if entries is None:
+        import feedparser # Imported lazily; only needed for the fallback path
+        feed = feedparser.parse(response.content)
+        if feed.bozo:
+            raise ValueError(f"feedparser failed to parse feed: {feed.bozo_exception}")
+        entries = [
+            {
+                "link": entry.get('link'),
+                "title": entry.get('title', ''),
+                "summary": entry.get('summary', '')
+            }
+            for entry in feed.entries
+        ]
 
-def mark_article_as_processed(url):
+    return [entry for entry in entries if entry['link']]
+
+def parse_feed_entries(content):
     """
-    Writes the processed article URL to DynamoDB with a 7-day TTL.
+    Parses RSS 2.0 or Atom XML into entry dicts.
+    Returns None for other feed formats so the caller can fall back to feedparser.
     """
-    ttl_timestamp = int((datetime.now(JST) + timedelta(days=7)).timestamp())
-    try:
-        dynamodb_table.put_item(
-            Item={
-                'article_url': url,
-                'processed_at': datetime.now(JST).isoformat(),
-                'ttl': ttl_timestamp
+    root = ET.fromstring(content)
+
+    # RSS 2.0: <rss><channel><item>
+    if root.tag == 'rss':
+        return [
+            {
+                "link": (item.findtext('link') or '').strip(),
+                "title": (item.findtext('title') or '').strip(),
+                "summary": (item.findtext('description') or '').strip()
             }
-        )
+            for item in root.iterfind('channel/item')
+        ]
+
+    # Atom: <feed><entry>
+    if root.tag == f'{ATOM_NS}feed':
+        entries = []
+        for entry in root.iterfind(f'{ATOM_NS}entry'):
+            links = entry.findall(f'{ATOM_NS}link')
+            link = next((link_el for link_el in links if link_el.get('rel', 'alternate') == 'alternate'), None)
+            entries.append({
+                "link": link.get('href', '').strip() if link is not None else '',
+                "title": (entry.findtext(f'{ATOM_NS}title') or '').strip(),
+                "summary": (entry.findtext(f'{ATOM_NS}summary') or '').strip()
+            })
+        return entries
+
+    return None
+
+def get_processed_article_urls(urls):
+    """
+    Checks DynamoDB in batches (BatchGetItem, max 100 keys per call) and returns
+    the set of article URLs that have already been processed.
+    """
+    processed_set = set()
+    unique_urls = []
+
+    # Short-circuit URLs already known to be processed from earlier warm invocations
+    # (dict.fromkeys also deduplicates, since BatchGetItem rejects duplicate keys)
+    for url in dict.fromkeys(urls):
+        if url in seen_url_cache:
+            seen_url_cache.move_to_end(url)
+            processed_set.add(url)
+        else:
+            unique_urls.append(url)
+
+    for i in range(0, len(unique_urls), DYNAMODB_BATCH_GET_LIMIT):
+        chunk = unique_urls[i:i + DYNAMODB_BATCH_GET_LIMIT]
+        request_items = {
+            DYNAMODB_TABLE_NAME: {
+                'Keys': [{'article_url': url} for url in chunk],
+                'ProjectionExpression': 'article_url'
+            }
+        }
+        try:
+            # Retry any keys DynamoDB could not serve in this round (throttling etc.)
+            # with capped exponential backoff; partial throttling returns a successful
+            # response, so botocore's own retry policy does not apply here
+            for attempt in range(DYNAMODB_BATCH_GET_MAX_ATTEMPTS):
+                if attempt > 0:
+                    time.sleep(min(0.05 * 2 ** attempt, 1))
+                response = dynamodb.batch_get_item(RequestItems=request_items)
+                for item in response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []):
+                    processed_set.add(item['article_url'])
+                    remember_processed_url(item['article_url'])
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    break
+            else:
+                # Fail safe: treat keys still unprocessed after all attempts as unprocessed
+                print(f"[WARN] DynamoDB batch_get_item left keys unprocessed after {DYNAMODB_BATCH_GET_MAX_ATTEMPTS} attempts.")
+        except Exception as e:
+            print(f"[ERROR] DynamoDB batch_get_item error: {e}")
+            # Fail safe: treat remaining URLs in this chunk as unprocessed
+
+    return processed_set
+
+def remember_processed_url(url):
+    """
+    Adds the URL to the in-memory LRU cache, evicting the oldest entries when full.
+    """
+    seen_url_cache[url] = None
+    seen_url_cache.move_to_end(url)
+    while len(seen_url_cache) > SEEN_URL_CACHE_MAX:
+        seen_url_cache.popitem(last=False)
+
+def mark_articles_as_processed(urls):
+    """
+    Writes the processed article URLs to DynamoDB with a 7-day TTL.
+    Uses batch_writer to send up to 25 items per BatchWriteItem request.
+    """
+    now = datetime.now(JST)
+    processed_at = now.isoformat()
+    ttl_timestamp = int(now.timestamp()) + ARTICLE_TTL_SECONDS
+    try:
+        with dynamodb_table.batch_writer(overwrite_by_pkeys=['article_url']) as batch:
+            for url in urls:
+                batch.put_item(
+                    Item={
+                        'article_url': url,
+                        'processed_at': processed_at,
+                        'ttl': ttl_timestamp
+                    }
+                )
+        # Cache only after the batch has been flushed successfully
+        for url in urls:
+            remember_processed_url(url)
     except Exception as e:
-        print(f"[ERROR] DynamoDB put_item error: {e}")
+        print(f"[ERROR] DynamoDB batch_write_item error: {e}")
 
-def analyze_papers_with_bedrock(papers, topic_hierarchy):
+def analyze_papers_with_bedrock(papers, context=None):
     """
     Calls Bedrock (Claude 3) to analyze a batch of papers using the
     L0-L6 hierarchical topic structure and advanced evaluation criteria.
+    Gives up with an empty selection when the Lambda context nears its deadline.
     """
     
-    topics_str = json.dumps(topic_hierarchy, ensure_ascii=False, indent=2)
-    papers_str = json.dumps(papers, ensure_ascii=False, indent=2)
+    papers_str = orjson.dumps(papers, option=orjson.OPT_INDENT_2).decode()
 
-    prompt = f"""
-    あなたは、複数の技術分野に精通した高度な学術専門家です。
-    あなたの任務は、提示された「論文リスト」を、定義された「トピック階層」に基づいて厳密に分析・評価し、最も価値のある論文を選定することです。
+    # Mark the end of the static system prompt as a cache point so the
+    # prefix (tools + system) is served from Bedrock's prompt cache
+    system_blocks = [{"text": SYSTEM_PROMPT}]
+    if BEDROCK_PROMPT_CACHE_ENABLED:
+        system_blocks.append({"cachePoint": {"type": "default"}})
 
-    ## トピック階層 (評価基準)
-    {topics_str}
+    # Reasoning models spend output tokens on thinking before the tool call
+    max_tokens = BEDROCK_MAX_TOKENS
+    if any(marker in (BEDROCK_MODEL_ID or '').lower() for marker in BEDROCK_REASONING_MODEL_MARKERS):
+        max_tokens += BEDROCK_REASONING_EXTRA_TOKENS
 
-    * L0_Domain: 学術ドメイン（研究分野）
-    * L1_Approach: 技術アプローチ（手法）
-    * L2_Task: タスク（目的・課題）
-    * L3_Modality: データモダリティ（入力情報）
-    * L4_Application: 応用分野（ユースケース）
-    * L5_Environment: 実装環境・制約条件
-    * L6_Challenge: 学習上の課題（研究テーマ的視点）
+    if bedrock_deadline_reached(context):
+        print("[ERROR] Not enough invocation time left to call Bedrock. Increase the function timeout.")
+        return {"selected_papers": []}
 
-    ## 論文リスト (分析対象)
-    {papers_str}
-
-    ## 指示 (厳守)
-    「論文リスト」の全論文を評価し、以下の「評価基準」に基づいて、最も価値が高いと判断される論文を**最大3件**まで選定してください。
+    print("Sending request to Bedrock...")
+    try:
+        # Force a tool call so the model returns structured JSON (no text parsing needed)
+        response = bedrock_runtime.converse_stream(
+            modelId=BEDROCK_MODEL_ID,
+            system=system_blocks,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [{"text": PAPER_LIST_HEADER + papers_str}]
+                }
+            ],
+            toolConfig={
+                "tools": [{"toolSpec": SELECT_PAPERS_TOOL_SPEC}],
+                "toolChoice": {"tool": {"name": SELECT_PAPERS_TOOL_SPEC["name"]}}
+            },
+            inferenceConfig={
+                "maxTokens": max_tokens,
+                "temperature": 0.0 # Deterministic selection; topP stays at its default of 1.0
+            }
+        )
 
-    ### 評価基準 (優先度順)
+        # Accumulate the streamed toolUse input fragments until the message stops
+        tool_input_fragments = []
+        stop_reason = None
+        for event in response['stream']:
+            # read_timeout only bounds idle gaps, so enforce the invocation deadline here
+            if bedrock_deadline_reached(context):
+                response['stream'].close()
+                print("[ERROR] Bedrock stream abandoned near the Lambda deadline. Increase the function timeout.")
+                return {"selected_papers": []}
 
-    1.  **最高評価 (High Priority: 課題解決・応用融合)**
-        * 複数のレイヤーにまたがる、価値の高い貢献をしている論文。
-        * **(パターンA: 課題解決型)** L6（課題）に対し、新しいL1（手法）やL2（タスク）を提案し、解決策を示している。
-        * **(パターンB: 応用融合型)** L1（手法）やL2（タスク）を、L4（応用分野）やL5（実装環境）に適用し、実用的な成果や新しい知見を提供している。
+            if 'contentBlockDelta' in event:
+                delta = event['contentBlockDelta']['delta']
+                if 'toolUse' in delta:
+                    tool_input_fragments.append(delta['toolUse']['input'])
+            elif 'messageStop' in event:
+                stop_reason = event['messageStop'].get('stopReason')
+            elif 'metadata' in event:
+                usage = event['metadata'].get('usage', {})
+                print(f"Bedrock token usage: input={usage.get('inputTokens')}, output={usage.get('outputTokens')}, "
+                      f"cache_read={usage.get('cacheReadInputTokens', 0)}, cache_write={usage.get('cacheWriteInputTokens', 0)}")
+
+        if not tool_input_fragments:
+            print(f"[ERROR] Bedrock response has no toolUse input. Stop reason: {stop_reason}")
+            return {"selected_papers": []}
 
-    2.  **中評価 (Medium Priority: 中核技術の革新)**
-        * L1（手法）またはL2（タスク）自体に、従来技術を大幅に超えるような画期的な（State-of-the-Art）提案、または新しい概念を提示している。
+        tool_input = "".join(tool_input_fragments)
+        try:
+            analysis_data = orjson.loads(tool_input)
+        except orjson.JSONDecodeError as e:
+            print(f"[ERROR] JSON parse error: {e}. Stop reason: {stop_reason}. Tool input: {tool_input}")
+            return {"selected_papers": []}
 
-    3.  **選定対象外 (Low Priority)**
-        * L0（ドメイン）の総説（Survey）論文。
-        * L3（モダリティ）のデータセット紹介のみ。
-        * L4（応用分野）のみに関連する、技術的新規性の低い事例報告。
+        print(f"Parsed JSON data: {analysis_data}")
 
-    ### 選定プロセス
-    * 「論文リスト」全体から、「最高評価」（パターンA, B）に合致する論文のみを選定対象とします。
-    * 「中評価」および「選定対象外」の基準に合致する論文は、選定しないでください。
-    * 「最高評価」に合致した論文の中から、重要度が高い順に最大3件を選定してください。
+        # Validate response structure
+        if 'selected_papers' not in analysis_data or not isinstance(analysis_data['selected_papers'], list):
+            print("[WARN] Bedrock response missing 'selected_papers' (list).")
+            return {"selected_papers": []}
 
-    ### 出力形式 (JSON)
-    選定した論文についてのみ、以下の情報をJSON形式で出力してください。
-    JSONオブジェクトのみを返し、前後にテキストを含めないでください。
+        return analysis_data
 
-    1.  `url`: 論文のURL (論文リストからそのままコピー)
-    2.  `title`: 論文のタイトル (論文リストからそのままコピー)
-    3.  `matched_topic`: **最も主要な貢献**と判断したトピック名（L1, L2, L4, L6などから）。**複数該当する場合は文字列のリスト**とすること。
-    4.  `summary`: アブストラクトの核心的な内容を、日本語で200文字程度に簡潔に要約してください。
-    5.  `keywords`: 論文の主要な日本語キーワードを**3件**程度のリスト。
+    except Exception as e:
+        print(f"[ERROR] Bedrock API call error: {e!r}")
+        return {"selected_papers": []}
 
-    例 (1件選定された場合):
-    {{
-      "selected_papers": [
-        {{
-          "url": "http://arxiv.org/abs/...",
-          "title": "農業用少数ショット学習",
-          "matched_topic": ["少数ショット", "農業ロボット工学"],
-          "summary": "少数ショット(L6)という課題に対し、新しい対照学習(L1)を提案。農業分野(L4)での作物分類(L2)タスクで有効性を実証。",
-          "keywords": ["少数ショット", "対照学習", "農業ロボット工学"]
-        }}
-      ]
-    }}
-    
-    例 (該当なしの場合):
-    {{
-      "selected_papers": []
-    }}
+def bedrock_deadline_reached(context):
     """
+    Returns True when the remaining invocation time is below the Bedrock safety margin.
+    """
+    if context is None:
+        return False
+    return context.get_remaining_time_in_millis() < BEDROCK_DEADLINE_MARGIN_SECONDS * 1000
 
-    body_json = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4096, 
-        "messages": [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": prompt}]
-            }
-        ]
-    })
-    
-    print("Sending request to Bedrock...")
+def prewarm_teams_connection():
+    """
+    Opens the pooled TCP/TLS connection to the Teams webhook ahead of time,
+    so the actual post does not pay the handshake latency.
+    """
+    if not TEAMS_WEBHOOK_URL:
+        return
     try:
-        response = bedrock_runtime.invoke_model(
-            body=body_json, 
-            modelId=BEDROCK_MODEL_ID, 
-            contentType='application/json', 
-            accept='application/json'
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        result_text = response_body['content'][0]['text']
-        
-        print(f"Bedrock raw response (result_text): {result_text}")
+        http_session.head(TEAMS_WEBHOOK_URL, timeout=5)
+    except requests.RequestException as e:
+        print(f"[WARN] Teams connection prewarm failed: {e}")
 
-        try:
-            # Extract JSON part from potential text enclosures
-            if '{' in result_text and '}' in result_text:
-                json_part = result_text[result_text.find('{') : result_text.rfind('}')+1]
-                analysis_data = json.loads(json_part)
-            else:
-                analysis_data = json.loads(result_text)
+def format_matched_topic(topic_value):
+    """
+    Normalizes matched_topic (a string or a list of strings) into display text.
+    """
+    if isinstance(topic_value, list):
+        return ", ".join(topic_value) if topic_value else '(N/A)'
+    return str(topic_value or '(N/A)')
 
-            print(f"Parsed JSON data: {analysis_data}")
-            
-            # Validate response structure
-            if 'selected_papers' not in analysis_data or not isinstance(analysis_data['selected_papers'], list):
-                print("[WARN] Bedrock response missing 'selected_papers' (list).")
-                return {"selected_papers": []}
-                
-            return analysis_data
-        
-        except json.JSONDecodeError as e:
-            print(f"[ERROR] JSON parse error: {e}. Response text: {result_text}")
-            return {"selected_papers": []}
+def render_paper_card_elements(i, paper):
+    """
+    Builds the Adaptive Card elements for a single paper (ranked i+1).
+    """
+    # 1. Paper Title (with ranking)
+    title_block = {
+        "type": "TextBlock",
+        "text": f"**{i+1}. {paper.get('title', '(No Title)')}**",
+        "size": "Medium",
+        "weight": "Bolder",
+        "wrap": True
+    }
 
-    except Exception as e:
-        print(f"[ERROR] Bedrock API call error: {e}")
-        # Re-raise the exception to be caught by the handler, 
-        # so DB update still occurs but the error is logged.
-        raise e
+    # 2. Topic, Keywords, and Summary in a single Markdown TextBlock
+    topic_str = format_matched_topic(paper.get('matched_topic'))
+    keywords_str = ", ".join(paper.get('keywords', []))
+    summary_str = paper.get('summary', '(No Summary)')
+
+    markdown_text = PAPER_MARKDOWN_TEMPLATE.format(topic=topic_str, keywords=keywords_str, summary=summary_str)
+
+    body_block = {
+        "type": "TextBlock",
+        "text": markdown_text,
+        "wrap": True,
+        "spacing": "Medium" # Space from the title
+    }
+
+    # 3. Action button (Link to paper)
+    action_block = {
+        "type": "ActionSet",
+        "actions": [
+            {
+                "type": "Action.OpenUrl",
+                "title": "元の論文 (arXiv) を読む",
+                "url": paper.get('url', '#')
+            }
+        ],
+        "spacing": "Medium" # Space from the summary block
+    }
+
+    # Add a separator line between papers (starting from the second paper)
+    if i > 0:
+        separator_block = {"type": "TextBlock", "text": "---", "separator": True}
+        return (separator_block, title_block, body_block, action_block)
+    return (title_block, body_block, action_block)
 
 def post_summary_to_teams(selected_papers):
     """
@@ -371,65 +744,9 @@ def post_summary_to_teams(selected_papers):
     using the user-specified TextBlock Markdown layout.
     """
     
-    card_body_elements = []
-
-    for i, paper in enumerate(selected_papers):
-        
-        # Add a separator line between papers (starting from the second paper)
-        if i > 0:
-            card_body_elements.append({"type": "TextBlock", "text": "---", "separator": True})
-
-        # 1. Paper Title (with ranking)
-        card_body_elements.append({
-            "type": "TextBlock",
-            "text": f"**{i+1}. {paper.get('title', '(No Title)')}**",
-            "size": "Medium",
-            "weight": "Bolder",
-            "wrap": True
-        })
-        
-        # 2. Topic, Keywords, and Summary in a single Markdown TextBlock
-        
-        # ▼▼▼ MODIFICATION: Handle list or string for matched_topic ▼▼▼
-        topic_value = paper.get('matched_topic', '(N/A)')
-        if isinstance(topic_value, list):
-            if not topic_value: # Handle empty list
-                topic_str = '(N/A)'
-            else:
-                topic_str = ", ".join(topic_value) # Join list into string
-        else:
-            topic_str = str(topic_value) # Fallback for single string
-        # ▲▲▲ MODIFICATION END ▲▲▲
-            
-        keywords_str = ", ".join(paper.get('keywords', []))
-        summary_str = paper.get('summary', '(No Summary)')
-
-        # \n\n creates a new paragraph (visual gap) in Markdown
-        markdown_text = (
-            f"**該当トピック:**\n{topic_str}\n\n"
-            f"**キーワード:**\n{keywords_str}\n\n"
-            f"{summary_str}"
-        )
-
-        card_body_elements.append({
-            "type": "TextBlock",
-            "text": markdown_text,
-            "wrap": True,
-            "spacing": "Medium" # Space from the title
-        })
-
-        # 3. Action button (Link to paper)
-        card_body_elements.append({
-            "type": "ActionSet",
-            "actions": [
-                {
-                    "type": "Action.OpenUrl",
-                    "title": "元の論文 (arXiv) を読む",
-                    "url": paper.get('url', '#')
-                }
-            ],
-            "spacing": "Medium" # Space from the summary block
-        })
+    card_body_elements = list(itertools.chain.from_iterable(
+        render_paper_card_elements(i, paper) for i, paper in enumerate(selected_papers)
+    ))
 
     # --- Full Adaptive Card Payload ---
     payload = {
@@ -455,7 +772,7 @@ def post_summary_to_teams(selected_papers):
         return False
     
     try:
-        response = requests.post(TEAMS_WEBHOOK_URL, json=payload, timeout=10)
+        response = http_session.post(TEAMS_WEBHOOK_URL, json=payload, timeout=10)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         print(f"Teams post result: {response.status_code}")
         return response.status_code == 200